@@ -0,0 +1,188 @@
+"""Incrementally maintained usage rollups.
+
+Every chat emits one event that is folded into two rollup documents in the
+usage_rollups collection - one for its hour and one for its day. Each rollup
+holds plain counters, the set of active users, an LLM latency histogram and a
+count-min sketch over normalized questions. The sketch estimate decides which
+questions enter the small "top" map, so reading the top questions for a
+bucket never scans the chats collection.
+"""
+import hashlib
+import heapq
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import pymongo
+from pymongo import ReturnDocument
+
+PERIODS = {
+    "hour": ("%Y-%m-%dT%H", timedelta(hours=1)),
+    "day": ("%Y-%m-%d", timedelta(days=1)),
+}
+
+# Count-min sketch dimensions - error is about total/CMS_WIDTH with
+# probability 1 - e^-CMS_DEPTH
+CMS_DEPTH = 4
+CMS_WIDTH = 1024
+# Questions kept per bucket; the map is trimmed back once it doubles
+TOP_K = 20
+MAX_QUESTION_LENGTH = 200
+# Upper bounds (ms) of the LLM latency histogram buckets
+LATENCY_BUCKETS_MS = [250, 500, 1000, 2000, 4000, 8000, 16000, 32000]
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="analytics")
+
+
+def question_key(question):
+    return " ".join(question.lower().split())[:MAX_QUESTION_LENGTH]
+
+
+def question_id(key):
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+
+def cms_cells(key):
+    """Flat indexes of the sketch cells for key - one per row"""
+    digest = hashlib.blake2b(key.encode("utf-8"), digest_size=4 * CMS_DEPTH).digest()
+    return [
+        row * CMS_WIDTH + int.from_bytes(digest[row * 4:row * 4 + 4], "big") % CMS_WIDTH
+        for row in range(CMS_DEPTH)
+    ]
+
+
+def _latency_bucket(latency_ms):
+    for bound in LATENCY_BUCKETS_MS:
+        if latency_ms <= bound:
+            return f"le_{bound}"
+    return "le_inf"
+
+
+def bucket_id(period, when):
+    fmt, _ = PERIODS[period]
+    return f"{period}:{when.strftime(fmt)}"
+
+
+def bucket_start(period, when):
+    if period == "hour":
+        return when.replace(minute=0, second=0, microsecond=0)
+    return when.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def record_chat(rollups, username, question, latency_ms=None, error=False, when=None):
+    """Fold one chat event into its hour and day rollups"""
+    when = when or datetime.utcnow()
+    key = question_key(question)
+    cells = cms_cells(key)
+
+    inc = {"chats": 1}
+    for cell in cells:
+        inc[f"cms.{cell}"] = 1
+    if error:
+        inc["llm_errors"] = 1
+    if latency_ms is not None:
+        inc["llm_calls"] = 1
+        inc["llm_latency_ms_sum"] = latency_ms
+        inc[f"llm_latency_buckets.{_latency_bucket(latency_ms)}"] = 1
+
+    update = {
+        "$inc": inc,
+        "$addToSet": {"users": username},
+    }
+    if latency_ms is not None:
+        update["$max"] = {"llm_latency_ms_max": latency_ms}
+
+    projection = {f"cms.{cell}": 1 for cell in cells}
+    projection["top"] = 1
+
+    # Each period is updated on its own, so a failed hour update still counts the day
+    for period in PERIODS:
+        update["$setOnInsert"] = {"period": period, "bucket_start": bucket_start(period, when)}
+        try:
+            doc = rollups.find_one_and_update(
+                {"_id": bucket_id(period, when)},
+                update,
+                projection=projection,
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+            estimate = min(doc["cms"][str(cell)] for cell in cells)
+            _update_top(rollups, doc, key, estimate)
+        except pymongo.errors.PyMongoError as e:
+            print(f"Warning: {period} usage rollup not updated: {e}")
+
+
+def _update_top(rollups, doc, key, estimate):
+    top = doc.get("top", {})
+    qid = question_id(key)
+    if qid not in top and len(top) >= TOP_K:
+        if estimate <= min(entry["count"] for entry in top.values()):
+            return
+
+    top[qid] = {"question": key, "count": estimate}
+    keep = set(top)
+    update = {}
+    if len(top) > 2 * TOP_K:
+        keep = set(heapq.nlargest(TOP_K, top, key=lambda other: top[other]["count"]))
+        update["$unset"] = {f"top.{other}": "" for other in top if other not in keep}
+    # A question trimmed right away is only unset - a path can't be in both operators
+    if qid in keep:
+        update["$set"] = {f"top.{qid}": top[qid]}
+    rollups.update_one({"_id": doc["_id"]}, update)
+
+
+def record_chat_async(rollups, username, question, latency_ms=None, error=False):
+    """Record a chat event off the request thread - failures are logged, never raised"""
+    when = datetime.utcnow()
+
+    _executor.submit(record_chat, rollups, username, question, latency_ms, error, when)
+
+
+def _approx_percentile(buckets, total, pct):
+    """Upper bound (ms) of the histogram bucket holding the pct-th percentile"""
+    if not total:
+        return None
+    target = total * pct / 100
+    seen = 0
+    for bound in LATENCY_BUCKETS_MS:
+        seen += buckets.get(f"le_{bound}", 0)
+        if seen >= target:
+            return bound
+    return None
+
+
+def read_rollups(rollups, period, end, count):
+    """Return the last `count` rollups of `period` ending at `end`, oldest first"""
+    _, step = PERIODS[period]
+    start = bucket_start(period, end)
+    ids = [bucket_id(period, start - step * i) for i in reversed(range(count))]
+
+    # Only the sketch and user set are large - count users server-side and drop both
+    docs = {
+        doc["_id"]: doc
+        for doc in rollups.aggregate([
+            {"$match": {"_id": {"$in": ids}}},
+            {"$addFields": {"active_users": {"$size": {"$ifNull": ["$users", []]}}}},
+            {"$project": {"cms": 0, "users": 0}},
+        ])
+    }
+
+    results = []
+    for i, rollup_id in enumerate(ids):
+        doc = docs.get(rollup_id, {})
+        llm_calls = doc.get("llm_calls", 0)
+        buckets = doc.get("llm_latency_buckets", {})
+        top = sorted(doc.get("top", {}).values(), key=lambda entry: entry["count"], reverse=True)
+        results.append({
+            "bucket": rollup_id.split(":", 1)[1],
+            "bucket_start": start - step * (count - 1 - i),
+            "chats": doc.get("chats", 0),
+            "active_users": doc.get("active_users", 0),
+            "llm": {
+                "calls": llm_calls,
+                "errors": doc.get("llm_errors", 0),
+                "avg_latency_ms": round(doc.get("llm_latency_ms_sum", 0) / llm_calls, 1) if llm_calls else None,
+                "max_latency_ms": doc.get("llm_latency_ms_max"),
+                "p95_latency_ms_upper_bound": _approx_percentile(buckets, llm_calls, 95),
+            },
+            "top_questions": top[:TOP_K],
+        })
+    return results
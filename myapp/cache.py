@@ -0,0 +1,191 @@
+"""Two-tier cache shared by every worker on the host.
+
+The front tier is a small per-process LRU. Behind it sits a SQLite file (WAL
+mode) that all gunicorn workers open, so a value computed by one worker is a
+hit for the others and survives worker recycling.
+
+Invalidation fans out through version stamps stored in the same file:
+invalidate(namespace) bumps the namespace's stamp, and since the stamp is part
+of every key, all workers stop seeing the old entries once they re-read it.
+Workers re-read a stamp at most every TIERED_CACHE_VERSION_CHECK_INTERVAL
+seconds, which bounds how long another worker can serve a stale entry. The
+worker that made the change sees it immediately.
+
+A value derived from a read that may race with an invalidation should be
+stored under the stamp taken before the read: call version(namespace) first
+and pass it to set(). If the namespace was invalidated in between, the value
+lands under the old stamp and is never served.
+"""
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+
+
+class TieredCache:
+    # Expired rows are purged from the shared tier every this many writes (per process)
+    CULL_EVERY = 500
+
+    def __init__(self, path, front_size, default_timeout, version_check_interval):
+        self.path = str(path)
+        self.front_size = front_size
+        self.default_timeout = default_timeout
+        self.version_check_interval = version_check_interval
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._front = OrderedDict()
+        # namespace -> (stamp, monotonic time it was read), oldest read first.
+        # Entries older than the check interval are useless and pruned, so this
+        # only holds namespaces touched in the last interval.
+        self._stamps = OrderedDict()
+        self._writes = 0
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache_entries "
+                "(key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache_versions "
+                "(namespace TEXT PRIMARY KEY, version INTEGER NOT NULL)"
+            )
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _read_version(self, namespace):
+        row = self._connection().execute(
+            "SELECT version FROM cache_versions WHERE namespace = ?", (namespace,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def _bump_version(self, namespace):
+        conn = self._connection()
+        conn.execute(
+            "INSERT INTO cache_versions (namespace, version) VALUES (?, 1) "
+            "ON CONFLICT(namespace) DO UPDATE SET version = version + 1",
+            (namespace,),
+        )
+        return self._read_version(namespace)
+
+    def _remember_stamp(self, namespace, stamp, now):
+        with self._lock:
+            self._stamps[namespace] = (stamp, now)
+            self._stamps.move_to_end(namespace)
+            while self._stamps:
+                _, (_, checked_at) = next(iter(self._stamps.items()))
+                if now - checked_at < self.version_check_interval:
+                    break
+                self._stamps.popitem(last=False)
+
+    def version(self, namespace):
+        """Current stamp of namespace, as seen by this worker"""
+        now = time.monotonic()
+        with self._lock:
+            cached = self._stamps.get(namespace)
+        if cached and now - cached[1] < self.version_check_interval:
+            return cached[0]
+
+        stamp = self._read_version(namespace)
+        self._remember_stamp(namespace, stamp, now)
+        return stamp
+
+    def _key(self, namespace, key, version=None):
+        if version is None:
+            version = self.version(namespace)
+        return f"{namespace}\x00{version}\x00{key}"
+
+    def _front_get(self, full_key, now):
+        with self._lock:
+            entry = self._front.get(full_key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < now:
+                del self._front[full_key]
+                return None
+            self._front.move_to_end(full_key)
+            return value
+
+    def _front_set(self, full_key, value, expires):
+        with self._lock:
+            self._front[full_key] = (value, expires)
+            self._front.move_to_end(full_key)
+            while len(self._front) > self.front_size:
+                self._front.popitem(last=False)
+
+    def get(self, namespace, key, default=None):
+        try:
+            full_key = self._key(namespace, key)
+            now = time.time()
+
+            value = self._front_get(full_key, now)
+            if value is None:
+                row = self._connection().execute(
+                    "SELECT value, expires FROM cache_entries WHERE key = ?", (full_key,)
+                ).fetchone()
+                if row is None or row[1] < now:
+                    return default
+                value = row[0]
+                self._front_set(full_key, value, row[1])
+            # Values are kept pickled in both tiers so callers never share a mutable object
+            return pickle.loads(value)
+        except sqlite3.Error as e:
+            print(f"Warning: cache read failed: {e}")
+            return default
+
+    def set(self, namespace, key, value, timeout=None, version=None):
+        """Store value; pass version (from version()) to store under that stamp"""
+        expires = time.time() + (timeout or self.default_timeout)
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        try:
+            full_key = self._key(namespace, key, version)
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO cache_entries (key, value, expires) VALUES (?, ?, ?)",
+                (full_key, data, expires),
+            )
+            self._front_set(full_key, data, expires)
+
+            with self._lock:
+                self._writes += 1
+                cull = self._writes % self.CULL_EVERY == 0
+            if cull:
+                conn.execute("DELETE FROM cache_entries WHERE expires < ?", (time.time(),))
+        except sqlite3.Error as e:
+            print(f"Warning: cache write failed: {e}")
+
+    def invalidate(self, namespace):
+        """Drop every entry in namespace on every worker"""
+        try:
+            stamp = self._bump_version(namespace)
+            self._remember_stamp(namespace, stamp, time.monotonic())
+        except sqlite3.Error as e:
+            print(f"Warning: cache invalidation failed: {e}")
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Return the process-wide cache, building it from settings on first use"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = TieredCache(
+                    settings.TIERED_CACHE_PATH,
+                    front_size=settings.TIERED_CACHE_FRONT_SIZE,
+                    default_timeout=settings.TIERED_CACHE_DEFAULT_TIMEOUT,
+                    version_check_interval=settings.TIERED_CACHE_VERSION_CHECK_INTERVAL,
+                )
+    return _cache
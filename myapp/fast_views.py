@@ -0,0 +1,63 @@
+"""Plain Django versions of the hot API endpoints.
+
+Each view here runs the same function as its DRF counterpart in views.py, but
+skips DRF's content negotiation, parser and renderer machinery: the body is
+decoded with json.loads and the result is returned as a JsonResponse. Enabled
+with API_FAST_VIEWS = True in settings.
+"""
+import json
+from django.http import HttpResponse, JsonResponse, HttpResponseNotAllowed
+from django.views.decorators.csrf import csrf_exempt
+from myapp import views
+
+
+def fast_json_view(drf_view):
+    """Build a plain Django view from a function decorated with @api_view"""
+    view_class = drf_view.cls
+    # @api_view always adds OPTIONS, which is APIView.options and needs a real
+    # APIView instance - it is answered here instead
+    allowed_methods = [m.upper() for m in view_class.http_method_names if m != "options"]
+
+    @csrf_exempt
+    def view(request, *args, **kwargs):
+        if request.method == "OPTIONS":
+            response = HttpResponse()
+            response["Allow"] = ", ".join(allowed_methods + ["OPTIONS"])
+            return response
+        if request.method not in allowed_methods:
+            return HttpResponseNotAllowed(allowed_methods)
+        handler = getattr(view_class, request.method.lower())
+
+        if request.body:
+            try:
+                request.data = json.loads(request.body)
+            except ValueError:
+                return JsonResponse({"error": "Invalid JSON body"}, status=400)
+            if not isinstance(request.data, dict):
+                return JsonResponse({"error": "Expected a JSON object"}, status=400)
+        else:
+            request.data = {}
+
+        response = handler(None, request, *args, **kwargs)
+        if not hasattr(response, "data"):
+            return response
+
+        if response.data is None:
+            json_response = HttpResponse(status=response.status_code)
+        else:
+            json_response = JsonResponse(response.data, status=response.status_code, safe=False)
+        # Keep headers the view set (e.g. ETag); the content type is ours
+        for header, value in response.items():
+            if header.lower() != "content-type":
+                json_response[header] = value
+        return json_response
+
+    view.__name__ = drf_view.__name__
+    view.__doc__ = drf_view.__doc__
+    return view
+
+
+chatbot_view = fast_json_view(views.chatbot_view)
+register_view = fast_json_view(views.register_view)
+login_view = fast_json_view(views.login_view)
+user_profile_view = fast_json_view(views.user_profile_view)
@@ -0,0 +1,247 @@
+"""LLM gateway - provider selection, deadlines, retries and hedged requests.
+
+Views call llm_gateway.complete(prompt). The gateway picks the provider named
+by settings.LLM_PROVIDER, bounds every call by a deadline, retries failures
+with jittered exponential backoff, and hedges slow calls: if the first request
+has not answered after the recent p95 latency, a second one is issued and the
+first answer wins.
+"""
+import math
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from django.conf import settings
+
+
+class LLMError(Exception):
+    """Raised when the LLM could not produce an answer"""
+
+
+class LLMTimeout(LLMError):
+    """Raised when the LLM did not answer before the request deadline"""
+
+
+class CohereProvider:
+    name = "cohere"
+
+    def __init__(self):
+        import cohere
+        self.client = cohere.Client(settings.COHERE_API_KEY)
+
+    def chat(self, prompt, timeout):
+        response = self.client.chat(
+            message=prompt,
+            # Retries are handled by the gateway, not the SDK
+            request_options={"timeout_in_seconds": max(1, math.ceil(timeout)), "max_retries": 0},
+        )
+        return response.text
+
+
+class StubProvider:
+    """Local provider for tests and development - no network calls"""
+    name = "stub"
+
+    def __init__(self):
+        self.latency = settings.LLM_STUB_LATENCY
+
+    def chat(self, prompt, timeout):
+        time.sleep(min(self.latency, timeout))
+        question = prompt.rsplit("User question:", 1)[-1].strip()
+        return f"[stub] You asked: {question}"
+
+
+PROVIDERS = {
+    CohereProvider.name: CohereProvider,
+    StubProvider.name: StubProvider,
+}
+
+
+def build_provider(name):
+    try:
+        return PROVIDERS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown LLM provider {name!r}, expected one of {sorted(PROVIDERS)}")
+
+
+def _percentile(samples, pct):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1)
+    return ordered[max(index, 0)]
+
+
+class LLMGateway:
+    # Latency samples kept for the hedge delay and the metrics percentiles
+    SAMPLE_SIZE = 500
+    # Below this many samples the configured LLM_HEDGE_DELAY is used instead of p95
+    MIN_HEDGE_SAMPLES = 20
+
+    def __init__(self, provider, hedge_provider=None):
+        self.provider = provider
+        self.hedge_provider = hedge_provider or provider
+        self._executor = ThreadPoolExecutor(max_workers=settings.LLM_GATEWAY_WORKERS, thread_name_prefix="llm")
+        self._lock = threading.Lock()
+        # Latency of the first request of each attempt - what callers would see without
+        # hedging. Failed and timed-out primaries count too, capped at the deadline.
+        self._primary_latencies = deque(maxlen=self.SAMPLE_SIZE)
+        # Successful primaries only - the hedge delay is based on these
+        self._successful_primary_latencies = deque(maxlen=self.SAMPLE_SIZE)
+        # Latency callers actually see from the gateway
+        self._gateway_latencies = deque(maxlen=self.SAMPLE_SIZE)
+        self._counters = {
+            "calls": 0,
+            "successes": 0,
+            "retries": 0,
+            "hedges_issued": 0,
+            "hedges_won": 0,
+            "errors": 0,
+            "timeouts": 0,
+        }
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def hedge_delay(self):
+        with self._lock:
+            samples = list(self._successful_primary_latencies)
+        if len(samples) < self.MIN_HEDGE_SAMPLES:
+            return settings.LLM_HEDGE_DELAY
+        return _percentile(samples, settings.LLM_HEDGE_PERCENTILE)
+
+    def complete(self, prompt, timeout=None):
+        """Return the reply text for prompt, or raise LLMError / LLMTimeout"""
+        start = time.monotonic()
+        deadline = start + (timeout or settings.LLM_DEADLINE_SECONDS)
+        self._count("calls")
+
+        last_error = None
+        for attempt in range(settings.LLM_MAX_RETRIES + 1):
+            if attempt:
+                # Full jitter: sleep a random amount up to the exponential backoff cap
+                backoff = random.uniform(0, settings.LLM_BACKOFF_BASE * (2 ** (attempt - 1)))
+                if time.monotonic() + backoff >= deadline:
+                    break
+                time.sleep(backoff)
+                self._count("retries")
+            try:
+                text = self._hedged_call(prompt, deadline)
+            except LLMTimeout:
+                self._count("timeouts")
+                raise
+            except Exception as e:
+                print(f"LLM attempt {attempt + 1} failed: {repr(e)}")
+                last_error = e
+                continue
+
+            with self._lock:
+                self._gateway_latencies.append(time.monotonic() - start)
+            self._count("successes")
+            return text
+
+        self._count("errors")
+        if last_error is None:
+            self._count("timeouts")
+            raise LLMTimeout("LLM deadline exceeded")
+        raise LLMError(f"LLM request failed: {last_error}") from last_error
+
+    def _call(self, provider, prompt, deadline):
+        return provider.chat(prompt, timeout=max(deadline - time.monotonic(), 0.001))
+
+    def _hedged_call(self, prompt, deadline):
+        start = time.monotonic()
+        budget = deadline - start
+        primary = self._executor.submit(self._call, self.provider, prompt, deadline)
+        recorded = []
+
+        def record_primary(future=None):
+            # Called when the primary finishes, or at the deadline if it is still
+            # running - whichever comes first is the primary's latency
+            elapsed = min(time.monotonic() - start, budget)
+            succeeded = future is not None and not future.cancelled() and future.exception() is None
+            with self._lock:
+                if recorded:
+                    return
+                recorded.append(elapsed)
+                self._primary_latencies.append(elapsed)
+                if succeeded:
+                    self._successful_primary_latencies.append(elapsed)
+
+        primary.add_done_callback(record_primary)
+
+        pending = {primary}
+        hedge_wait = min(self.hedge_delay(), max(deadline - time.monotonic(), 0))
+        done, _ = wait(pending, timeout=hedge_wait)
+        if not done and time.monotonic() < deadline:
+            pending.add(self._executor.submit(self._call, self.hedge_provider, prompt, deadline))
+            self._count("hedges_issued")
+
+        last_error = None
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is not primary:
+                        self._count("hedges_won")
+                    return future.result()
+                last_error = future.exception()
+
+        if not primary.done():
+            record_primary()
+        if pending or last_error is None:
+            raise LLMTimeout("LLM deadline exceeded")
+        raise last_error
+
+    def metrics(self):
+        with self._lock:
+            counters = dict(self._counters)
+            primary = list(self._primary_latencies)
+            gateway = list(self._gateway_latencies)
+
+        def summary(samples):
+            return {
+                f"p{pct}_ms": round(value * 1000, 1) if value is not None else None
+                for pct, value in ((50, _percentile(samples, 50)),
+                                   (95, _percentile(samples, 95)),
+                                   (99, _percentile(samples, 99)))
+            }
+
+        unhedged = summary(primary)
+        hedged = summary(gateway)
+        p99_saved = None
+        if unhedged["p99_ms"] is not None and hedged["p99_ms"] is not None:
+            p99_saved = round(unhedged["p99_ms"] - hedged["p99_ms"], 1)
+
+        return {
+            "provider": self.provider.name,
+            "hedge_provider": self.hedge_provider.name,
+            "hedge_delay_ms": round(self.hedge_delay() * 1000, 1),
+            "counters": counters,
+            "unhedged_latency": unhedged,
+            "gateway_latency": hedged,
+            "p99_saved_by_hedging_ms": p99_saved,
+        }
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway():
+    """Return the process-wide gateway, building it from settings on first use"""
+    global _gateway
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                provider = build_provider(settings.LLM_PROVIDER)
+                hedge_provider = None
+                if settings.LLM_HEDGE_PROVIDER and settings.LLM_HEDGE_PROVIDER != settings.LLM_PROVIDER:
+                    hedge_provider = build_provider(settings.LLM_HEDGE_PROVIDER)
+                _gateway = LLMGateway(provider, hedge_provider)
+    return _gateway
@@ -0,0 +1,99 @@
+import heapq
+from collections import defaultdict
+from datetime import datetime, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from pymongo import UpdateOne
+from myapp import analytics
+from myapp.views import chats_collection, rollups_collection
+
+
+class Command(BaseCommand):
+    help = "Rebuild the hourly and daily usage rollups from the chats collection"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=None,
+                            help="Only rebuild the last N days (default: all history)")
+
+    def handle(self, *args, **options):
+        if chats_collection is None or rollups_collection is None:
+            raise CommandError("MongoDB is not available. Check MONGO_URI.")
+
+        since = None
+        if options["days"]:
+            since = analytics.bucket_start("day", datetime.utcnow() - timedelta(days=options["days"] - 1))
+
+        for period in analytics.PERIODS:
+            written = self.rebuild(period, since)
+            self.stdout.write(f"{period}: rebuilt {written} rollups")
+
+        self.stdout.write(self.style.SUCCESS(
+            "Backfill complete. The current hour and day are left to live events. LLM "
+            "latency is not stored in chat history, so latency counters only cover "
+            "events recorded live."
+        ))
+
+    def rebuild(self, period, since):
+        fmt, _ = analytics.PERIODS[period]
+        # Only closed buckets are rebuilt. The open bucket is still receiving live
+        # events, so replacing it would drop chats recorded during the backfill.
+        cutoff = analytics.bucket_start(period, datetime.utcnow())
+        match = {"messages.role": "user", "messages.timestamp": {"$lt": cutoff}}
+        if since:
+            match["messages.timestamp"]["$gte"] = since
+
+        # One row per (bucket, question) with its count and askers
+        pipeline = [
+            {"$unwind": "$messages"},
+            {"$match": match},
+            {"$group": {
+                "_id": {
+                    "bucket": {"$dateToString": {"format": fmt, "date": "$messages.timestamp"}},
+                    "question": "$messages.content",
+                },
+                "count": {"$sum": 1},
+                "users": {"$addToSet": "$username"},
+            }},
+        ]
+
+        chats = defaultdict(int)
+        users = defaultdict(set)
+        cms = defaultdict(lambda: defaultdict(int))
+        questions = defaultdict(lambda: defaultdict(int))
+        for row in chats_collection.aggregate(pipeline, allowDiskUse=True):
+            rollup_id = f"{period}:{row['_id']['bucket']}"
+            key = analytics.question_key(row["_id"]["question"])
+            chats[rollup_id] += row["count"]
+            users[rollup_id].update(row["users"])
+            questions[rollup_id][key] += row["count"]
+            for cell in analytics.cms_cells(key):
+                cms[rollup_id][str(cell)] += row["count"]
+
+        # Overwrite the rebuilt fields in place rather than delete + insert, so the
+        # rebuild never collides with a concurrent upsert on the same _id. The llm_*
+        # counters can't be rebuilt from history and are left as recorded live.
+        requests = []
+        rebuilt_ids = set()
+        for rollup_id, chat_count in chats.items():
+            top = heapq.nlargest(analytics.TOP_K, questions[rollup_id].items(), key=lambda item: item[1])
+            rebuilt_ids.add(rollup_id)
+            requests.append(UpdateOne({"_id": rollup_id}, {"$set": {
+                "period": period,
+                "bucket_start": datetime.strptime(rollup_id.split(":", 1)[1], fmt),
+                "chats": chat_count,
+                "users": sorted(users[rollup_id]),
+                "cms": dict(cms[rollup_id]),
+                "top": {
+                    analytics.question_id(key): {"question": key, "count": count}
+                    for key, count in top
+                },
+            }}, upsert=True))
+        if requests:
+            rollups_collection.bulk_write(requests, ordered=False)
+
+        # Buckets in range with no chats left in history
+        stale = {"period": period, "_id": {"$nin": list(rebuilt_ids)}, "bucket_start": {"$lt": cutoff}}
+        if since:
+            stale["bucket_start"]["$gte"] = since
+        rollups_collection.delete_many(stale)
+
+        return len(requests)
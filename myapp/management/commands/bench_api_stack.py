@@ -0,0 +1,61 @@
+import logging
+import time
+import types
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from django.urls import path
+from myapp import fast_views, views
+from myapp.middleware import MiddlewareChainHandler
+
+
+def _urlconf(view):
+    """Minimal urlconf serving the profile endpoint with the given view"""
+    urlconf = types.ModuleType("bench_api_stack_urls")
+    urlconf.urlpatterns = [path("api/auth/profile/", view)]
+    return urlconf
+
+
+class Command(BaseCommand):
+    help = "Measure per-request overhead of the full and lean API middleware stacks"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=5000, help="Requests per stack")
+
+    def handle(self, *args, **options):
+        count = options["requests"]
+        full_middleware = [m for m in settings.MIDDLEWARE if m != "myapp.middleware.ApiProfileMiddleware"]
+        drf_urls = _urlconf(views.user_profile_view)
+        fast_urls = _urlconf(fast_views.user_profile_view)
+
+        # An unauthenticated profile request returns 401 without touching MongoDB,
+        # so the timings below are pure framework overhead
+        stacks = [
+            ("full middleware + DRF view", full_middleware, drf_urls),
+            ("lean middleware + DRF view", settings.API_MIDDLEWARE, drf_urls),
+            ("lean middleware + plain view", settings.API_MIDDLEWARE, fast_urls),
+            ("no middleware + plain view", [], fast_urls),
+        ]
+
+        factory = RequestFactory()
+        # Keep the 401 "Unauthorized" warnings out of the timings and the output
+        logging.getLogger("django.request").setLevel(logging.ERROR)
+        self.stdout.write(f"{count} requests per stack")
+        for name, middleware, urlconf in stacks:
+            handler = MiddlewareChainHandler(middleware)
+
+            def run_once():
+                request = factory.get("/api/auth/profile/", HTTP_HOST="localhost")
+                request.urlconf = urlconf
+                response = handler.get_response(request)
+                assert response.status_code == 401, response.status_code
+
+            for _ in range(min(count, 200)):
+                run_once()
+
+            start = time.perf_counter()
+            for _ in range(count):
+                run_once()
+            elapsed = time.perf_counter() - start
+
+            self.stdout.write(f"{name:<32} {elapsed / count * 1e6:8.1f} us/request")
@@ -0,0 +1,64 @@
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.core.handlers.base import BaseHandler
+from django.core.handlers.exception import convert_exception_to_response
+from django.utils.module_loading import import_string
+
+
+class MiddlewareChainHandler(BaseHandler):
+    """Request handler that runs its own middleware list instead of settings.MIDDLEWARE"""
+
+    def __init__(self, middleware):
+        super().__init__()
+        self.middleware = list(middleware)
+        self.load_middleware()
+
+    def load_middleware(self, is_async=False):
+        """Build the chain from self.middleware the same way BaseHandler does (sync only)"""
+        if is_async:
+            raise ImproperlyConfigured("MiddlewareChainHandler only supports synchronous middleware")
+
+        self._view_middleware = []
+        self._template_response_middleware = []
+        self._exception_middleware = []
+
+        handler = convert_exception_to_response(self._get_response)
+        for middleware_path in reversed(self.middleware):
+            middleware = import_string(middleware_path)
+            try:
+                mw_instance = middleware(handler)
+            except MiddlewareNotUsed:
+                continue
+            if mw_instance is None:
+                raise ImproperlyConfigured(f"Middleware factory {middleware_path} returned None.")
+
+            if hasattr(mw_instance, "process_view"):
+                self._view_middleware.insert(0, mw_instance.process_view)
+            if hasattr(mw_instance, "process_template_response"):
+                self._template_response_middleware.append(mw_instance.process_template_response)
+            if hasattr(mw_instance, "process_exception"):
+                self._exception_middleware.append(mw_instance.process_exception)
+
+            handler = convert_exception_to_response(mw_instance)
+
+        self._middleware_chain = handler
+
+
+class ApiProfileMiddleware:
+    """Route /api/ requests through the lean API_MIDDLEWARE chain.
+
+    Must be the first entry in MIDDLEWARE. With API_PROFILE = "full" it removes
+    itself and every request goes through the regular stack.
+    """
+
+    def __init__(self, get_response):
+        if settings.API_PROFILE != "lean":
+            raise MiddlewareNotUsed("API_PROFILE is not 'lean'")
+        self.get_response = get_response
+        self.api_prefix = settings.API_PREFIX
+        self.api_handler = MiddlewareChainHandler(settings.API_MIDDLEWARE)
+
+    def __call__(self, request):
+        if request.path_info.startswith(self.api_prefix):
+            return self.api_handler.get_response(request)
+        return self.get_response(request)
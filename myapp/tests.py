@@ -1,3 +1,573 @@
-from django.test import TestCase
+"""Tests for the chat API, LLM gateway, usage rollups and tiered cache.
 
-# Create your tests here.
+MongoDB is replaced by mongomock and the LLM by local providers, so no network
+is needed. views.py still requires MONGO_URI at import time (the client is
+lazy and never connects):
+
+    MONGO_URI=mongodb://localhost:1 LLM_PROVIDER=stub python manage.py test myapp
+"""
+import io
+import json
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from unittest import mock
+import mongomock
+import pymongo
+from django.conf import settings
+from django.core.management import call_command
+from django.http import JsonResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from django.urls import path
+from myapp import analytics, fast_views, views
+from myapp.management.commands import backfill_usage_rollups
+from myapp.cache import TieredCache
+from myapp.llm import LLMGateway, LLMError, LLMTimeout, StubProvider
+from myapp.middleware import MiddlewareChainHandler
+
+
+class FakeProvider:
+    """LLM provider with scripted per-call latencies and failures"""
+    name = "fake"
+
+    def __init__(self, latencies=None, failures=0):
+        self.latencies = latencies or {}
+        self.failures = failures
+        self.prompts = []
+        self._lock = threading.Lock()
+
+    @property
+    def calls(self):
+        return len(self.prompts)
+
+    def chat(self, prompt, timeout):
+        with self._lock:
+            self.prompts.append(prompt)
+            call = len(self.prompts)
+        if call <= self.failures:
+            raise RuntimeError(f"call {call} failed")
+        question = prompt.rsplit("User question:", 1)[-1].strip()
+        latency = self.latencies.get(question, self.latencies.get(call, 0))
+        time.sleep(min(latency, timeout))
+        if latency > timeout:
+            raise TimeoutError(f"call {call} timed out")
+        return f"answer {call}: {question}"
+
+
+class ApiTestCase(SimpleTestCase):
+    """Runs views against mongomock, a temporary tiered cache and a fake LLM"""
+
+    def setUp(self):
+        db = mongomock.MongoClient().db
+        self.db = db
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = TieredCache(
+            Path(self.cache_dir) / "cache.sqlite3",
+            front_size=64, default_timeout=60, version_check_interval=1,
+        )
+        self.provider = FakeProvider()
+        gateway = LLMGateway(self.provider)
+        for name, value in {
+            "users_collection": db.users,
+            "chats_collection": db.chats,
+            "rollups_collection": None,
+            "get_cache": lambda: self.cache,
+            "get_gateway": lambda: gateway,
+        }.items():
+            patcher = mock.patch.object(views, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(shutil.rmtree, self.cache_dir, ignore_errors=True)
+
+        db.users.insert_one({"_id": "alice", "username": "alice", "email": "alice@example.com"})
+        access, _ = views._generate_tokens("alice")
+        self.auth = {"HTTP_AUTHORIZATION": f"Bearer {access}"}
+
+    def post_batch(self, questions):
+        return self.client.post(
+            "/api/chat/batch/", {"questions": questions}, content_type="application/json", **self.auth
+        )
+
+    def read_stream(self, response):
+        return [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+
+
+class ChatBatchTests(ApiTestCase):
+
+    def test_results_follow_input_order_when_llm_finishes_out_of_order(self):
+        self.provider.latencies = {"Slow?": 0.3, "Fast?": 0}
+        lines = self.read_stream(self.post_batch(["Slow?", "Fast?"]))
+
+        self.assertEqual([line.get("index") for line in lines[:2]], [0, 1])
+        self.assertTrue(lines[0]["response"].endswith("Slow?"))
+        self.assertTrue(lines[1]["response"].endswith("Fast?"))
+        self.assertTrue(lines[-1]["done"])
+
+    def test_duplicates_and_cache_hits_skip_the_llm(self):
+        views._set_cached_answer("Cached?", "from cache")
+        lines = self.read_stream(self.post_batch(["What is GPA?", "what is  gpa?", "Cached?", "SAT?"]))
+
+        self.assertEqual(self.provider.calls, 2)
+        self.assertEqual(lines[0]["response"], lines[1]["response"])
+        self.assertEqual(lines[1]["index"], 1)
+        self.assertEqual(lines[2]["response"], "from cache")
+
+    def test_batch_is_saved_in_one_session(self):
+        lines = self.read_stream(self.post_batch(["A?", "B?"]))
+
+        chats = list(self.db.chats.find())
+        self.assertEqual(len(chats), 1)
+        self.assertEqual(len(chats[0]["messages"]), 4)
+        self.assertEqual(lines[-1]["session_id"], str(chats[0]["_id"]))
+
+    def test_answers_are_saved_when_client_disconnects(self):
+        response = self.post_batch(["A?", "B?", "C?"])
+        next(iter(response.streaming_content))
+        response.close()
+
+        chats = list(self.db.chats.find())
+        self.assertEqual(len(chats), 1)
+        self.assertEqual(len(chats[0]["messages"]), 6)
+
+    def test_invalid_items_are_rejected_with_their_indexes(self):
+        response = self.post_batch(["What is GPA?", 5, "  ", "SAT?"])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["invalid_indexes"], [1, 2])
+        self.assertEqual(self.provider.calls, 0)
+
+
+def probe_view(request):
+    """Reports which middleware touched the request"""
+    return JsonResponse({"session": hasattr(request, "session"), "user": hasattr(request, "user")})
+
+
+# Used as ROOT_URLCONF by ApiProfileTests
+urlpatterns = [
+    path("api/probe/", probe_view),
+    path("probe/", probe_view),
+]
+
+
+class RecordingMiddleware:
+    """Captures settings.MIDDLEWARE as seen while the chain is being built"""
+    seen_middleware = None
+
+    def __init__(self, get_response):
+        RecordingMiddleware.seen_middleware = list(settings.MIDDLEWARE)
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+
+@override_settings(ROOT_URLCONF="myapp.tests", API_PROFILE="lean")
+class ApiProfileTests(SimpleTestCase):
+
+    def test_api_requests_skip_session_auth_and_clickjacking_middleware(self):
+        response = self.client.get("/api/probe/")
+
+        self.assertEqual(response.json(), {"session": False, "user": False})
+        self.assertFalse(response.has_header("X-Frame-Options"))
+
+    def test_other_paths_use_the_full_stack(self):
+        response = self.client.get("/probe/")
+
+        self.assertEqual(response.json(), {"session": True, "user": True})
+        self.assertTrue(response.has_header("X-Frame-Options"))
+
+    def test_api_requests_skip_csrf_checks(self):
+        client = self.client_class(enforce_csrf_checks=True)
+
+        self.assertEqual(client.post("/api/probe/").status_code, 200)
+        self.assertEqual(client.post("/probe/").status_code, 403)
+
+    @override_settings(API_PROFILE="full")
+    def test_full_profile_uses_the_full_stack_everywhere(self):
+        self.assertEqual(self.client.get("/api/probe/").json(), {"session": True, "user": True})
+
+    def test_chain_is_built_without_touching_global_settings(self):
+        full_middleware = list(settings.MIDDLEWARE)
+
+        MiddlewareChainHandler(["myapp.tests.RecordingMiddleware"])
+
+        self.assertEqual(RecordingMiddleware.seen_middleware, full_middleware)
+        self.assertEqual(list(settings.MIDDLEWARE), full_middleware)
+
+
+class FastViewTests(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.factory = RequestFactory()
+
+    def test_options_is_answered_with_allow_header(self):
+        response = fast_views.chatbot_view(self.factory.options("/api/chat/"))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Allow"], "POST, OPTIONS")
+
+    def test_undeclared_methods_return_405(self):
+        response = fast_views.chatbot_view(self.factory.get("/api/chat/"))
+
+        self.assertEqual(response.status_code, 405)
+        self.assertEqual(response["Allow"], "POST")
+
+    def test_body_must_be_a_json_object(self):
+        for body in ("not json", "[1, 2]"):
+            request = self.factory.post("/api/auth/login/", body, content_type="application/json")
+            self.assertEqual(fast_views.login_view(request).status_code, 400)
+
+    def test_json_response_matches_drf_view(self):
+        response = fast_views.user_profile_view(self.factory.get("/api/auth/profile/", **self.auth))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/json")
+        self.assertEqual(json.loads(response.content)["username"], "alice")
+
+    def test_headers_set_by_the_view_are_kept(self):
+        history_view = fast_views.fast_json_view(views.chatbot_history_view)
+
+        etag = history_view(self.factory.get("/api/chat/history/", **self.auth))["ETag"]
+        response = history_view(self.factory.get("/api/chat/history/", HTTP_IF_NONE_MATCH=etag, **self.auth))
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+        self.assertEqual(response.content, b"")
+
+@override_settings(
+    LLM_DEADLINE_SECONDS=2, LLM_MAX_RETRIES=2, LLM_BACKOFF_BASE=0.01,
+    LLM_HEDGE_DELAY=0.05, LLM_HEDGE_PERCENTILE=95, LLM_STUB_LATENCY=0,
+)
+class LLMGatewayTests(SimpleTestCase):
+
+    def test_stub_provider_answers_locally(self):
+        gateway = LLMGateway(StubProvider())
+
+        self.assertEqual(gateway.complete("User question: What is GPA?"), "[stub] You asked: What is GPA?")
+
+    def test_slow_primary_is_hedged_and_hedge_wins(self):
+        provider = FakeProvider(latencies={1: 1.0})
+        gateway = LLMGateway(provider)
+
+        start = time.monotonic()
+        reply = gateway.complete("User question: Q")
+
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertEqual(reply, "answer 2: Q")
+        counters = gateway.metrics()["counters"]
+        self.assertEqual(counters["hedges_issued"], 1)
+        self.assertEqual(counters["hedges_won"], 1)
+
+    def test_fast_primary_is_not_hedged(self):
+        provider = FakeProvider()
+        gateway = LLMGateway(provider)
+
+        gateway.complete("User question: Q")
+
+        self.assertEqual(provider.calls, 1)
+        self.assertEqual(gateway.metrics()["counters"]["hedges_issued"], 0)
+
+    def test_hedge_delay_follows_recent_p95(self):
+        gateway = LLMGateway(FakeProvider())
+        with gateway._lock:
+            gateway._successful_primary_latencies.extend([0.01] * 19 + [0.2])
+            # Failed primaries are in the unhedged latency but not the hedge delay
+            gateway._primary_latencies.extend([5.0] * 20)
+
+        self.assertEqual(gateway.hedge_delay(), 0.01)
+
+    def test_failed_primaries_count_towards_unhedged_latency(self):
+        provider = FakeProvider(failures=1)
+        gateway = LLMGateway(provider)
+
+        gateway.complete("User question: Q")
+
+        self.assertEqual(len(gateway._primary_latencies), 2)
+        self.assertEqual(len(gateway._successful_primary_latencies), 1)
+
+    def test_timed_out_primary_is_recorded_at_the_deadline(self):
+        provider = FakeProvider(latencies={1: 1.0, 2: 1.0})
+        gateway = LLMGateway(provider)
+
+        with self.assertRaises(LLMTimeout):
+            gateway.complete("User question: Q", timeout=0.2)
+        time.sleep(0.1)
+
+        self.assertEqual(len(gateway._primary_latencies), 1)
+        self.assertAlmostEqual(gateway._primary_latencies[0], 0.2, delta=0.05)
+        self.assertEqual(len(gateway._successful_primary_latencies), 0)
+        self.assertIsNotNone(gateway.metrics()["unhedged_latency"]["p99_ms"])
+
+    def test_failures_are_retried(self):
+        provider = FakeProvider(failures=2)
+        gateway = LLMGateway(provider)
+
+        self.assertEqual(gateway.complete("User question: Q"), "answer 3: Q")
+        self.assertEqual(gateway.metrics()["counters"]["retries"], 2)
+
+    def test_gives_up_after_max_retries(self):
+        provider = FakeProvider(failures=10)
+        gateway = LLMGateway(provider)
+
+        with self.assertRaises(LLMError):
+            gateway.complete("User question: Q")
+        self.assertEqual(provider.calls, 3)
+        self.assertEqual(gateway.metrics()["counters"]["errors"], 1)
+
+    def test_deadline_is_enforced(self):
+        provider = FakeProvider(latencies={1: 1.0, 2: 1.0})
+        gateway = LLMGateway(provider)
+
+        start = time.monotonic()
+        with self.assertRaises(LLMTimeout):
+            gateway.complete("User question: Q", timeout=0.2)
+        self.assertLess(time.monotonic() - start, 0.6)
+        self.assertEqual(gateway.metrics()["counters"]["timeouts"], 1)
+
+
+class UsageRollupTests(SimpleTestCase):
+
+    def setUp(self):
+        self.rollups = mongomock.MongoClient().db.usage_rollups
+        self.now = datetime(2026, 10, 19, 14, 30)
+
+    def test_counters_users_and_latency(self):
+        analytics.record_chat(self.rollups, "alice", "Q?", latency_ms=100, when=self.now)
+        analytics.record_chat(self.rollups, "bob", "Q?", latency_ms=3000, when=self.now)
+        analytics.record_chat(self.rollups, "alice", "Q?", when=self.now)
+        analytics.record_chat(self.rollups, "bob", "Q?", error=True, when=self.now)
+
+        bucket = analytics.read_rollups(self.rollups, "hour", self.now, 1)[0]
+
+        self.assertEqual(bucket["bucket"], "2026-10-19T14")
+        self.assertEqual(bucket["chats"], 4)
+        self.assertEqual(bucket["active_users"], 2)
+        self.assertEqual(bucket["llm"]["calls"], 2)
+        self.assertEqual(bucket["llm"]["errors"], 1)
+        self.assertEqual(bucket["llm"]["avg_latency_ms"], 1550)
+        self.assertEqual(bucket["llm"]["max_latency_ms"], 3000)
+        self.assertEqual(bucket["llm"]["p95_latency_ms_upper_bound"], 4000)
+
+    def test_top_questions_are_tracked_and_bounded(self):
+        for i in range(3 * analytics.TOP_K):
+            analytics.record_chat(self.rollups, "alice", f"rare {i}", when=self.now)
+        for _ in range(5):
+            analytics.record_chat(self.rollups, "alice", "What is  GPA?", when=self.now)
+        for _ in range(3):
+            analytics.record_chat(self.rollups, "alice", "how to apply?", when=self.now)
+
+        bucket = analytics.read_rollups(self.rollups, "day", self.now, 1)[0]
+        doc = self.rollups.find_one({"_id": "day:2026-10-19"})
+
+        self.assertEqual(bucket["top_questions"][0], {"question": "what is gpa?", "count": 5})
+        self.assertEqual(bucket["top_questions"][1], {"question": "how to apply?", "count": 3})
+        self.assertEqual(len(bucket["top_questions"]), analytics.TOP_K)
+        self.assertLessEqual(len(doc["top"]), 2 * analytics.TOP_K)
+
+    def test_trimming_never_sets_and_unsets_the_same_question(self):
+        update_one = self.rollups.update_one
+
+        def checked_update_one(query, update, *args, **kwargs):
+            self.assertFalse(set(update.get("$set", {})) & set(update.get("$unset", {})))
+            return update_one(query, update, *args, **kwargs)
+
+        with mock.patch.object(self.rollups, "update_one", checked_update_one):
+            for i in range(analytics.TOP_K):
+                analytics.record_chat(self.rollups, "alice", f"rare {i}", when=self.now)
+            for i in range(analytics.TOP_K):
+                for _ in range(5):
+                    analytics.record_chat(self.rollups, "alice", f"popular {i}", when=self.now)
+            # Enters the full map with count 2, pushing it past 2 * TOP_K, and is trimmed at once
+            for _ in range(2):
+                analytics.record_chat(self.rollups, "alice", "newcomer", when=self.now)
+
+        for period in analytics.PERIODS:
+            doc = self.rollups.find_one({"_id": analytics.bucket_id(period, self.now)})
+            self.assertEqual(doc["chats"], 6 * analytics.TOP_K + 2)
+            self.assertEqual(len(doc["top"]), analytics.TOP_K)
+            self.assertEqual({entry["count"] for entry in doc["top"].values()}, {5})
+
+    def test_failed_hour_update_still_counts_the_day(self):
+        find_one_and_update = self.rollups.find_one_and_update
+
+        def failing_hour(query, *args, **kwargs):
+            if query["_id"].startswith("hour:"):
+                raise pymongo.errors.AutoReconnect("connection lost")
+            return find_one_and_update(query, *args, **kwargs)
+
+        with mock.patch.object(self.rollups, "find_one_and_update", failing_hour), \
+                mock.patch("builtins.print"):
+            analytics.record_chat(self.rollups, "alice", "Q?", when=self.now)
+
+        self.assertEqual(analytics.read_rollups(self.rollups, "hour", self.now, 1)[0]["chats"], 0)
+        self.assertEqual(analytics.read_rollups(self.rollups, "day", self.now, 1)[0]["chats"], 1)
+
+    def test_read_returns_empty_buckets_oldest_first(self):
+        analytics.record_chat(self.rollups, "alice", "Q?", when=self.now - timedelta(days=1))
+
+        buckets = analytics.read_rollups(self.rollups, "day", self.now, 3)
+
+        self.assertEqual([b["bucket"] for b in buckets], ["2026-10-17", "2026-10-18", "2026-10-19"])
+        self.assertEqual([b["chats"] for b in buckets], [0, 1, 0])
+
+    def test_backfill_rebuilds_closed_buckets_and_keeps_the_open_one(self):
+        db = mongomock.MongoClient().db
+        now = datetime.utcnow()
+        past = now - timedelta(days=2)
+        db.chats.insert_many([
+            {"username": "alice", "messages": [
+                {"role": "user", "content": "What is GPA?", "timestamp": past},
+                {"role": "bot", "content": "...", "timestamp": past},
+            ]},
+            {"username": "bob", "messages": [{"role": "user", "content": "what is gpa?", "timestamp": past}]},
+            {"username": "bob", "messages": [{"role": "user", "content": "Live?", "timestamp": now}]},
+        ])
+        # Live rollups for a closed and the open day, plus a stale closed bucket with no history
+        analytics.record_chat(db.usage_rollups, "alice", "What is GPA?", latency_ms=20, when=past)
+        analytics.record_chat(db.usage_rollups, "bob", "Live?", latency_ms=10, when=now)
+        db.usage_rollups.insert_one({"_id": "day:2000-01-01", "period": "day", "bucket_start": datetime(2000, 1, 1)})
+
+        with mock.patch.object(backfill_usage_rollups, "chats_collection", db.chats), \
+                mock.patch.object(backfill_usage_rollups, "rollups_collection", db.usage_rollups):
+            for _ in range(2):
+                call_command("backfill_usage_rollups", stdout=io.StringIO())
+
+        closed = analytics.read_rollups(db.usage_rollups, "day", past, 1)[0]
+        open_day = analytics.read_rollups(db.usage_rollups, "day", now, 1)[0]
+        self.assertEqual(closed["chats"], 2)
+        self.assertEqual(closed["active_users"], 2)
+        self.assertEqual(closed["top_questions"], [{"question": "what is gpa?", "count": 2}])
+        self.assertEqual(closed["llm"]["calls"], 1)
+        self.assertEqual(open_day["llm"]["calls"], 1)
+        self.assertIsNone(db.usage_rollups.find_one({"_id": "day:2000-01-01"}))
+
+
+class ChatUsageTests(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(views, "rollups_collection", self.db.usage_rollups)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Record synchronously so the assertions see the events
+        patcher = mock.patch.object(analytics, "record_chat_async", analytics.record_chat)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def llm_calls(self):
+        doc = self.db.usage_rollups.find_one({"period": "day"})
+        return doc["chats"], doc.get("llm_calls", 0)
+
+    def test_cache_hits_are_not_counted_as_llm_calls(self):
+        for _ in range(2):
+            self.client.post("/api/chat/", {"message": "Q?"}, content_type="application/json", **self.auth)
+
+        self.assertEqual(self.llm_calls(), (2, 1))
+
+    def test_batch_records_latency_for_each_real_llm_call(self):
+        self.read_stream(self.post_batch(["A?", "B?", "a?"]))
+
+        self.assertEqual(self.llm_calls(), (3, 2))
+
+    @override_settings(LLM_MAX_RETRIES=0)
+    def test_batch_records_an_error_for_each_failed_item(self):
+        self.provider.failures = 1
+        lines = self.read_stream(self.post_batch(["A?", "a?"]))
+
+        self.assertEqual([("error" in line) for line in lines[:2]], [True, True])
+        doc = self.db.usage_rollups.find_one({"period": "day"})
+        self.assertEqual(doc["llm_errors"], 2)
+
+
+class TieredCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir, ignore_errors=True)
+        path = Path(cache_dir) / "cache.sqlite3"
+        # Two instances on one file stand in for two workers
+        self.worker_a = TieredCache(path, front_size=8, default_timeout=60, version_check_interval=0.05)
+        self.worker_b = TieredCache(path, front_size=8, default_timeout=60, version_check_interval=0.05)
+
+    def test_values_are_shared_between_workers(self):
+        self.worker_a.set("answer", "q", {"reply": "hi"})
+
+        self.assertEqual(self.worker_b.get("answer", "q"), {"reply": "hi"})
+
+    def test_invalidation_reaches_other_workers(self):
+        self.worker_a.set("history:alice", "etag", '"v1"')
+        self.assertEqual(self.worker_b.get("history:alice", "etag"), '"v1"')
+
+        self.worker_a.invalidate("history:alice")
+
+        self.assertIsNone(self.worker_a.get("history:alice", "etag"))
+        time.sleep(0.1)
+        self.assertIsNone(self.worker_b.get("history:alice", "etag"))
+
+    def test_value_set_under_a_superseded_version_is_never_served(self):
+        version = self.worker_a.version("history:alice")
+        self.worker_b.invalidate("history:alice")
+        self.worker_a.set("history:alice", "etag", '"stale"', version=version)
+
+        time.sleep(0.1)
+        self.assertIsNone(self.worker_a.get("history:alice", "etag"))
+        self.assertIsNone(self.worker_b.get("history:alice", "etag"))
+
+    def test_entries_expire(self):
+        self.worker_a.set("answer", "q", "hi", timeout=0.05)
+        time.sleep(0.1)
+
+        self.assertIsNone(self.worker_a.get("answer", "q"))
+        self.assertIsNone(self.worker_b.get("answer", "q"))
+
+    def test_stamp_map_only_keeps_recent_namespaces(self):
+        for i in range(100):
+            self.worker_a.version(f"history:user{i}")
+        time.sleep(0.1)
+        self.worker_a.version("answer")
+
+        self.assertEqual(list(self.worker_a._stamps), ["answer"])
+
+
+class HistoryETagTests(ApiTestCase):
+
+    def get_history(self, etag=None):
+        headers = dict(self.auth)
+        if etag:
+            headers["HTTP_IF_NONE_MATCH"] = etag
+        return self.client.get("/api/chat/history/", **headers)
+
+    def test_unchanged_history_returns_304(self):
+        views._save_chat_messages("alice", [{"role": "user", "content": "Q?"}])
+        etag = self.get_history()["ETag"]
+
+        with mock.patch.object(self.db.chats, "find", side_effect=AssertionError("queried Mongo")):
+            response = self.get_history(etag)
+
+        self.assertEqual(response.status_code, 304)
+
+    def test_write_racing_the_history_read_does_not_leave_a_stale_etag(self):
+        views._save_chat_messages("alice", [{"role": "user", "content": "first"}])
+        stale_etag = self.get_history()["ETag"]
+        views._save_chat_messages("alice", [{"role": "user", "content": "second"}])
+
+        real_find = self.db.chats.find
+
+        def find_then_race(*args, **kwargs):
+            # Mongo returns the 2-chat state, then a third chat and its
+            # invalidation land before the view stores the new ETag
+            entries = list(real_find(*args, **kwargs))
+            views._save_chat_messages("alice", [{"role": "user", "content": "third"}])
+            return entries
+
+        with mock.patch.object(self.db.chats, "find", side_effect=find_then_race):
+            raced_etag = self.get_history()["ETag"]
+
+        response = self.get_history(raced_etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["chats"]), 3)
+        self.assertEqual(self.get_history(stale_etag).status_code, 200)
@@ -6,18 +6,21 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 from rest_framework import status
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 import os
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor
 import pymongo
 import jwt
 from datetime import datetime, timedelta
-import cohere
 from bson import ObjectId
 from bson.errors import InvalidId
+from myapp import analytics
+from myapp.cache import get_cache
+from myapp.llm import get_gateway, LLMTimeout
 
-# Load API key
 COHERE_API_KEY = os.getenv("COHERE_API_KEY")
-cohere_client = cohere.Client(COHERE_API_KEY)
 
 # MongoDB setup - MUST have MONGO_URI set, no localhost fallback
 MONGO_URI = os.getenv("MONGO_URI")
@@ -52,11 +55,13 @@ except Exception as e:
 mongo_db = None
 users_collection = None
 chats_collection = None
+rollups_collection = None
 
 if mongo_client:
     mongo_db = mongo_client[MONGO_DB_NAME]
     users_collection = mongo_db["users"]
     chats_collection = mongo_db["chats"]
+    rollups_collection = mongo_db["usage_rollups"]
 else:
     print("WARNING: Database collections not initialized")
 
@@ -77,12 +82,18 @@ def root_view(request):
             },
             "chat": {
                 "message": "POST /api/chat/",
+                "batch": "POST /api/chat/batch/",
                 "history": "GET /api/chat/history/",
                 "clear": "DELETE /api/chat/clear/",
+            },
+            "admin": {
+                "llm_metrics": "GET /api/admin/llm-metrics/",
+                "usage": "GET /api/admin/usage/",
             }
         },
         "mongodb": "connected" if mongo_client else "disconnected - check MONGO_URI credentials",
-        "cohere": "configured" if COHERE_API_KEY else "not configured"
+        "cohere": "configured" if COHERE_API_KEY else "not configured",
+        "llm_provider": settings.LLM_PROVIDER,
     }, status=status.HTTP_200_OK)
 
 
@@ -128,6 +139,10 @@ def _generate_tokens(user_id):
     return access, refresh
 
 
+# Verified users are cached across workers; the password hash is never loaded
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", "300"))
+
+
 def _get_user_from_token(request):
     auth_header = request.headers.get("Authorization", "")
     if not auth_header.startswith("Bearer "):
@@ -138,8 +153,14 @@ def _get_user_from_token(request):
         user_id = payload.get("sub")
         if not user_id:
             return None
+        cached_user = get_cache().get("user", user_id)
+        if cached_user is not None:
+            return cached_user
         try:
-            return users_collection.find_one({"_id": user_id})
+            user_doc = users_collection.find_one({"_id": user_id}, {"password": 0})
+            if user_doc:
+                get_cache().set("user", user_id, user_doc, timeout=USER_CACHE_TTL)
+            return user_doc
         except pymongo.errors.OperationFailure as e:
             print(f"MongoDB authentication error: {e}")
             raise Exception("Database authentication failed") from e
@@ -153,6 +174,10 @@ def _get_user_from_token(request):
         return None
 
 
+def _is_admin(user_doc):
+    return user_doc["_id"] in settings.API_ADMIN_USERS
+
+
 # Authentication Views
 @api_view(['POST'])
 @permission_classes([AllowAny])
@@ -368,6 +393,111 @@ topics. Be friendly, professional, and provide detailed, accurate information. I
 an answer, say so rather than making up information.
 """
 
+# Batch endpoint limits - the executor is shared so concurrent batches
+# together never exceed CHAT_BATCH_MAX_WORKERS in-flight LLM calls
+BATCH_MAX_QUESTIONS = int(os.getenv("CHAT_BATCH_MAX_QUESTIONS", "50"))
+BATCH_MAX_WORKERS = int(os.getenv("CHAT_BATCH_MAX_WORKERS", "8"))
+_batch_executor = ThreadPoolExecutor(max_workers=BATCH_MAX_WORKERS, thread_name_prefix="chat-batch")
+
+# Answers are shared by all workers through the tiered cache, so repeated
+# questions skip the LLM round trip
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", "3600"))
+
+
+def _normalize_question(question):
+    return " ".join(question.lower().split())
+
+
+def _answer_cache_key(question):
+    return hashlib.sha1(_normalize_question(question).encode("utf-8")).hexdigest()
+
+
+def _get_cached_answer(question):
+    return get_cache().get("answer", _answer_cache_key(question))
+
+
+def _set_cached_answer(question, answer):
+    get_cache().set("answer", _answer_cache_key(question), answer, timeout=ANSWER_CACHE_TTL)
+
+
+def _record_usage(username, question, latency_ms=None, error=False):
+    """Emit a chat event into the usage rollups without blocking the request"""
+    if rollups_collection is not None:
+        analytics.record_chat_async(rollups_collection, username, question, latency_ms, error)
+
+
+def _ask_advisor(user_message):
+    """Answer a single question, from the cache or the LLM.
+
+    Returns (reply, llm_latency_ms) - the latency is None when no LLM call was made.
+    """
+    cached = _get_cached_answer(user_message)
+    if cached is not None:
+        return cached, None
+
+    # Use Cohere Chat API (Generate API deprecated as of Sept 15, 2025)
+    # Prepend system prompt to user message since chat() doesn't have system param
+    full_message = f"{COLLEGE_ADVISOR_PROMPT}\n\nUser question: {user_message}"
+
+    llm_started = time.monotonic()
+    reply_text = get_gateway().complete(full_message)
+    llm_latency_ms = (time.monotonic() - llm_started) * 1000
+
+    if not reply_text:
+        return "I'm not sure how to answer that.", llm_latency_ms
+
+    bot_reply = reply_text.strip()
+    _set_cached_answer(user_message, bot_reply)
+    return bot_reply, llm_latency_ms
+
+
+def _history_namespace(username):
+    return f"history:{username}"
+
+
+def _history_etag(chat_entries):
+    digest = hashlib.sha1()
+    for entry in chat_entries:
+        digest.update(f"{entry['_id']}|{entry.get('updated_at')}|{len(entry.get('messages', []))};".encode("utf-8"))
+    return f'"{digest.hexdigest()}"'
+
+
+def _save_chat_messages(username, messages, session_id=None):
+    """Append messages to an existing session (or start a new one) in a single write.
+
+    Returns the session id the messages were stored under.
+    """
+    now = datetime.utcnow()
+
+    if session_id:
+        try:
+            session_object_id = ObjectId(session_id)
+            result = chats_collection.update_one(
+                {"_id": session_object_id, "username": username},
+                {
+                    "$push": {"messages": {"$each": messages}},
+                    "$set": {"updated_at": now}
+                }
+            )
+            if result.matched_count == 0:
+                session_id = None
+        except InvalidId:
+            session_id = None
+
+    if not session_id:
+        chat_entry = {
+            "username": username,
+            "messages": messages,
+            "created_at": now,
+            "updated_at": now
+        }
+        insert_result = chats_collection.insert_one(chat_entry)
+        session_id = str(insert_result.inserted_id)
+
+    get_cache().invalidate(_history_namespace(username))
+    return session_id
+
+
 @csrf_exempt
 @api_view(['POST'])
 @permission_classes([AllowAny])
@@ -390,15 +520,11 @@ def chatbot_view(request):
             )
 
         try:
-            # Use Cohere Chat API (Generate API deprecated as of Sept 15, 2025)
-            # Prepend system prompt to user message since chat() doesn't have system param
-            full_message = f"{COLLEGE_ADVISOR_PROMPT}\n\nUser question: {user_message}"
-            
-            response = cohere_client.chat(
-                message=full_message,
-            )
-
-            bot_reply = response.text.strip() if response.text else "I'm not sure how to answer that."
+            try:
+                bot_reply, llm_latency_ms = _ask_advisor(user_message)
+            except Exception:
+                _record_usage(user_doc["_id"], user_message, error=True)
+                raise
 
             # Store messages in MongoDB
             try:
@@ -415,30 +541,7 @@ def chatbot_view(request):
                     "timestamp": now
                 }
 
-                if session_id:
-                    try:
-                        session_object_id = ObjectId(session_id)
-                        result = chats_collection.update_one(
-                            {"_id": session_object_id, "username": username},
-                            {
-                                "$push": {"messages": {"$each": [user_msg, bot_msg]}},
-                                "$set": {"updated_at": now}
-                            }
-                        )
-                        if result.matched_count == 0:
-                            session_id = None
-                    except InvalidId:
-                        session_id = None
-
-                if not session_id:
-                    chat_entry = {
-                        "username": username,
-                        "messages": [user_msg, bot_msg],
-                        "created_at": now,
-                        "updated_at": now
-                    }
-                    insert_result = chats_collection.insert_one(chat_entry)
-                    session_id = str(insert_result.inserted_id)
+                session_id = _save_chat_messages(username, [user_msg, bot_msg], session_id)
             except pymongo.errors.OperationFailure as db_err:
                 print(f"Warning: Chat not saved to database (auth error): {db_err}")
                 # Still return the response even if storage fails
@@ -446,12 +549,20 @@ def chatbot_view(request):
                 print(f"Warning: Chat not saved to database (connection error): {db_err}")
                 # Still return the response even if storage fails
 
+            _record_usage(user_doc["_id"], user_message, latency_ms=llm_latency_ms)
+
             response_payload = {"response": bot_reply}
             if session_id:
                 response_payload["session_id"] = str(session_id)
 
             return Response(response_payload)
 
+        except LLMTimeout as e:
+            print(f"Chatbot timeout: {repr(e)}")
+            return Response(
+                {"error": "The advisor took too long to respond. Please try again."},
+                status=status.HTTP_504_GATEWAY_TIMEOUT
+            )
         except Exception as e:
             print(f"Chatbot error: {repr(e)}")
             import traceback
@@ -461,6 +572,129 @@ def chatbot_view(request):
     return Response({"error": "Invalid request"}, status=status.HTTP_400_BAD_REQUEST)
 
 
+@csrf_exempt
+@api_view(['POST'])
+@permission_classes([AllowAny])
+def chatbot_batch_view(request):
+    """Answer a list of questions in one request.
+
+    Questions are deduplicated and answered from the cache where possible; the
+    rest are fanned out to the LLM through a bounded thread pool. Results are
+    streamed back as newline-delimited JSON in the order they were asked, and
+    the whole batch is stored with a single database write.
+    """
+    try:
+        user_doc = _get_user_from_token(request)
+        if not user_doc:
+            return Response({"error": "Unauthorized"}, status=status.HTTP_401_UNAUTHORIZED)
+    except Exception as e:
+        return _handle_mongo_error(str(e))
+
+    questions = request.data.get("questions")
+    session_id = request.data.get("session_id")
+
+    if not isinstance(questions, list):
+        return Response(
+            {"error": "Please provide a list of questions"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    invalid = [i for i, q in enumerate(questions) if not isinstance(q, str) or not q.strip()]
+    if invalid:
+        return Response(
+            {"error": "Every question must be a non-empty string", "invalid_indexes": invalid},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    questions = [q.strip() for q in questions]
+    if not questions:
+        return Response(
+            {"error": "Please provide at least one question"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if len(questions) > BATCH_MAX_QUESTIONS:
+        return Response(
+            {"error": f"A batch can contain at most {BATCH_MAX_QUESTIONS} questions"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    # Deduplicate and resolve cache hits before anything reaches the LLM
+    answers = {}
+    errors = {}
+    futures = {}
+    for question in questions:
+        key = _normalize_question(question)
+        if key in answers or key in futures:
+            continue
+        cached = _get_cached_answer(question)
+        if cached is not None:
+            answers[key] = cached
+        else:
+            futures[key] = _batch_executor.submit(_ask_advisor, question)
+
+    username = user_doc["_id"]
+
+    def batch_result(index, question):
+        key = _normalize_question(question)
+        result = {"index": index, "question": question}
+        # Only the first occurrence of a question that reached the LLM carries
+        # its latency; every item the client sees fail is recorded as an error
+        latency_ms = None
+        if key in errors:
+            result["error"] = errors[key]
+            _record_usage(username, question, error=True)
+            return result
+        if key not in answers:
+            try:
+                answers[key], latency_ms = futures[key].result()
+            except Exception as e:
+                print(f"Batch chatbot error: {repr(e)}")
+                errors[key] = str(e)
+                result["error"] = errors[key]
+                _record_usage(username, question, error=True)
+                return result
+
+        result["response"] = answers[key]
+        _record_usage(username, question, latency_ms=latency_ms)
+        return result
+
+    def save_results(results):
+        now = datetime.utcnow()
+        messages = []
+        for result in results:
+            if "response" in result:
+                messages.append({"role": "user", "content": result["question"], "timestamp": now})
+                messages.append({"role": "bot", "content": result["response"], "timestamp": now})
+        if not messages:
+            return None
+        try:
+            return _save_chat_messages(username, messages, session_id)
+        except pymongo.errors.OperationFailure as db_err:
+            print(f"Warning: Batch not saved to database (auth error): {db_err}")
+        except (pymongo.errors.ServerSelectionTimeoutError, pymongo.errors.NetworkTimeout) as db_err:
+            print(f"Warning: Batch not saved to database (connection error): {db_err}")
+        return None
+
+    def stream_results():
+        results = []
+        saved_session_id = None
+        try:
+            for index, question in enumerate(questions):
+                result = batch_result(index, question)
+                results.append(result)
+                yield json.dumps(result) + "\n"
+        finally:
+            # Runs on client disconnect too, so answers already paid for are
+            # still collected and saved to history in one write
+            for index in range(len(results), len(questions)):
+                results.append(batch_result(index, questions[index]))
+            saved_session_id = save_results(results)
+
+        yield json.dumps({"done": True, "session_id": saved_session_id}) + "\n"
+
+    return StreamingHttpResponse(stream_results(), content_type="application/x-ndjson")
+
+
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def chatbot_history_view(request):
@@ -474,7 +708,18 @@ def chatbot_history_view(request):
 
     try:
         username = user_doc["_id"]
-        
+        if_none_match = request.headers.get("If-None-Match")
+
+        # The ETag of the last history served is cached until this user's chats change,
+        # so an unchanged history is answered without querying MongoDB. The stamp is
+        # taken before the query: if a write invalidates the namespace while we read,
+        # the ETag is stored under the old stamp and never served.
+        cache = get_cache()
+        history_version = cache.version(_history_namespace(username))
+        etag = cache.get(_history_namespace(username), "etag")
+        if etag and if_none_match == etag:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
         # Fetch all chat entries for this user, sorted by newest first
         chat_entries = list(chats_collection.find(
             {"username": username},
@@ -485,9 +730,14 @@ def chatbot_history_view(request):
         for entry in chat_entries:
             entry["_id"] = str(entry["_id"])
 
+        etag = _history_etag(chat_entries)
+        cache.set(_history_namespace(username), "etag", etag, version=history_version)
+        if if_none_match == etag:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
         return Response({
             "chats": chat_entries
-        }, status=status.HTTP_200_OK)
+        }, status=status.HTTP_200_OK, headers={"ETag": etag})
 
     except pymongo.errors.OperationFailure as e:
         print(f"MongoDB authentication error: {e}")
@@ -515,6 +765,7 @@ def chatbot_clear_history_view(request):
     try:
         username = user_doc["_id"]
         result = chats_collection.delete_many({"username": username})
+        get_cache().invalidate(_history_namespace(username))
 
         return Response({
             "message": f"Deleted {result.deleted_count} chat entries",
@@ -530,4 +781,68 @@ def chatbot_clear_history_view(request):
         print(f"Clear history error: {repr(e)}")
         import traceback
         traceback.print_exc()
-        return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
\ No newline at end of file
+        return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def llm_metrics_view(request):
+    """LLM gateway latency, retry and hedging metrics - admin users only"""
+    try:
+        user_doc = _get_user_from_token(request)
+        if not user_doc:
+            return Response({"error": "Unauthorized"}, status=status.HTTP_401_UNAUTHORIZED)
+    except Exception as e:
+        return _handle_mongo_error(str(e))
+
+    if not _is_admin(user_doc):
+        return Response({"error": "Forbidden"}, status=status.HTTP_403_FORBIDDEN)
+
+    return Response(get_gateway().metrics(), status=status.HTTP_200_OK)
+
+
+# Max buckets a single usage request may read, per period
+USAGE_MAX_BUCKETS = {"hour": 168, "day": 90}
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def usage_analytics_view(request):
+    """Usage rollups (chats, active users, LLM latency, top questions) - admin users only
+
+    Query params: period=hour|day (default day), count=number of buckets (default 7)
+    """
+    try:
+        user_doc = _get_user_from_token(request)
+        if not user_doc:
+            return Response({"error": "Unauthorized"}, status=status.HTTP_401_UNAUTHORIZED)
+    except Exception as e:
+        return _handle_mongo_error(str(e))
+
+    if not _is_admin(user_doc):
+        return Response({"error": "Forbidden"}, status=status.HTTP_403_FORBIDDEN)
+
+    period = request.query_params.get("period", "day")
+    if period not in USAGE_MAX_BUCKETS:
+        return Response(
+            {"error": "period must be 'hour' or 'day'"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    try:
+        count = int(request.query_params.get("count", 7))
+    except ValueError:
+        count = 0
+    if not 1 <= count <= USAGE_MAX_BUCKETS[period]:
+        return Response(
+            {"error": f"count must be between 1 and {USAGE_MAX_BUCKETS[period]}"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    try:
+        buckets = analytics.read_rollups(rollups_collection, period, datetime.utcnow(), count)
+        return Response({"period": period, "buckets": buckets}, status=status.HTTP_200_OK)
+    except pymongo.errors.OperationFailure as e:
+        print(f"MongoDB authentication error: {e}")
+        return _handle_mongo_error("Database authentication failed. Check MongoDB Atlas credentials.")
+    except (pymongo.errors.ServerSelectionTimeoutError, pymongo.errors.NetworkTimeout) as e:
+        return _handle_mongo_error(str(e))
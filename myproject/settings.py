@@ -34,6 +34,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'myapp.middleware.ApiProfileMiddleware',  # Must stay first - no-op unless API_PROFILE is "lean"
     'corsheaders.middleware.CorsMiddleware',  # Place this as high as possible
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -45,6 +46,21 @@ MIDDLEWARE = [
     'whitenoise.middleware.WhiteNoiseMiddleware'
 ]
 
+# API profile - "lean" sends /api/ requests through API_MIDDLEWARE only.
+# The API authenticates with its own JWT over MongoDB, so it needs no sessions,
+# messages, auth, CSRF or clickjacking middleware (and never touches db.sqlite3).
+API_PROFILE = os.getenv("API_PROFILE", "full")
+API_PREFIX = "/api/"
+API_MIDDLEWARE = [
+    'corsheaders.middleware.CorsMiddleware',
+    'django.middleware.security.SecurityMiddleware',
+    'django.middleware.common.CommonMiddleware',
+]
+
+# Serve the hot chat/auth endpoints with plain Django views (myapp/fast_views.py)
+# instead of DRF's negotiation, parsing and rendering
+API_FAST_VIEWS = os.getenv("API_FAST_VIEWS", "0") == "1"
+
 # CORS setup to allow frontend requests
 CORS_ALLOWED_ORIGINS = [
     
@@ -117,11 +133,33 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# LLM gateway (myapp/llm.py) - provider is "cohere" or "stub" (local, for tests)
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "cohere")
+LLM_HEDGE_PROVIDER = os.getenv("LLM_HEDGE_PROVIDER", "")  # Defaults to LLM_PROVIDER
+LLM_DEADLINE_SECONDS = float(os.getenv("LLM_DEADLINE_SECONDS", "30"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_HEDGE_DELAY = float(os.getenv("LLM_HEDGE_DELAY", "5"))  # Used until enough samples for p95
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+LLM_GATEWAY_WORKERS = int(os.getenv("LLM_GATEWAY_WORKERS", "32"))
+LLM_STUB_LATENCY = float(os.getenv("LLM_STUB_LATENCY", "0"))
+
 # Load API key from .env
 COHERE_API_KEY = os.getenv("COHERE_API_KEY")
-if not COHERE_API_KEY:
+if "cohere" in (LLM_PROVIDER, LLM_HEDGE_PROVIDER) and not COHERE_API_KEY:
     raise ValueError("Missing COHERE_API_KEY in environment variables")
 
+# Two-tier cache (myapp/cache.py) - per-process LRU in front of a SQLite file
+# shared by all workers on the host. Invalidations reach other workers within
+# TIERED_CACHE_VERSION_CHECK_INTERVAL seconds.
+TIERED_CACHE_PATH = os.getenv("TIERED_CACHE_PATH", str(BASE_DIR / "cache.sqlite3"))
+TIERED_CACHE_FRONT_SIZE = int(os.getenv("TIERED_CACHE_FRONT_SIZE", "1024"))
+TIERED_CACHE_DEFAULT_TIMEOUT = int(os.getenv("TIERED_CACHE_DEFAULT_TIMEOUT", "300"))
+TIERED_CACHE_VERSION_CHECK_INTERVAL = float(os.getenv("TIERED_CACHE_VERSION_CHECK_INTERVAL", "1"))
+
+# Comma-separated usernames allowed to call the /api/admin/ endpoints
+API_ADMIN_USERS = [u.strip() for u in os.getenv("API_ADMIN_USERS", "").split(",") if u.strip()]
+
 # REST Framework Configuration
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
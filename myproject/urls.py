@@ -14,17 +14,29 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path, include
-from myapp.views import root_view, chatbot_view, register_view, login_view, user_profile_view, chatbot_history_view, chatbot_clear_history_view
+from myapp.views import root_view, chatbot_view, chatbot_batch_view, register_view, login_view, user_profile_view, chatbot_history_view, chatbot_clear_history_view, llm_metrics_view, usage_analytics_view
+
+if settings.API_FAST_VIEWS:
+    from myapp import fast_views
+    chatbot_view = fast_views.chatbot_view
+    register_view = fast_views.register_view
+    login_view = fast_views.login_view
+    user_profile_view = fast_views.user_profile_view
 
 urlpatterns = [
     path('', root_view, name='root'),
     path('admin/', admin.site.urls),
     path('api/chat/', chatbot_view, name='chatbot_api'),
+    path('api/chat/batch/', chatbot_batch_view, name='chatbot_batch'),
     path('api/chat/history/', chatbot_history_view, name='chatbot_history'),
     path('api/chat/clear/', chatbot_clear_history_view, name='chatbot_clear'),
     path('api/auth/register/', register_view, name='register'),
     path('api/auth/login/', login_view, name='login'),
     path('api/auth/profile/', user_profile_view, name='profile'),
+    path('api/admin/llm-metrics/', llm_metrics_view, name='llm_metrics'),
+    path('api/admin/usage/', usage_analytics_view, name='usage_analytics'),
 ]
+